@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+import json
+
+import requests
+
+from events import DATA_DIR
+
+USER_AGENT = "eddimed-medals-bot/1.0 (https://github.com/Eddimed/eddimed_webpage)"
+
+CACHE_DIR = DATA_DIR / ".cache"
+
+_session = None
+
+
+def session():
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        _session.headers["User-Agent"] = USER_AGENT
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=4)
+        _session.mount("https://", adapter)
+        _session.mount("http://", adapter)
+    return _session
+
+
+def conditional_get(url, meta=None, timeout=30):
+    headers = {}
+    if meta:
+        if meta.get("last_etag"):
+            headers["If-None-Match"] = meta["last_etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+    resp = session().get(url, headers=headers, timeout=timeout)
+    if resp.status_code != 304:
+        resp.raise_for_status()
+    return resp
+
+
+def cache_paths(event_key):
+    return CACHE_DIR / f"{event_key}_page.html", CACHE_DIR / f"{event_key}_page.meta.json"
+
+
+def store_cached_page(event_key, resp):
+    html_path, meta_path = cache_paths(event_key)
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    html_path.write_text(resp.text, encoding="utf-8")
+    cached_meta = {
+        "etag": resp.headers.get("ETag"),
+        "last_modified": resp.headers.get("Last-Modified"),
+    }
+    meta_path.write_text(json.dumps(cached_meta) + "\n", encoding="utf-8")
+
+
+def load_cached_page(event_key):
+    html_path, meta_path = cache_paths(event_key)
+    if not html_path.exists() or not meta_path.exists():
+        return None
+    html = html_path.read_text(encoding="utf-8")
+    cached_meta = json.loads(meta_path.read_text(encoding="utf-8"))
+    # The cache is single-use: etag_check produces it and fetch_medals
+    # consumes it, so a later run never parses a stale page.
+    html_path.unlink()
+    meta_path.unlink()
+    return html, cached_meta
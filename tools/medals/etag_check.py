@@ -2,10 +2,8 @@
 import json
 import os
 import sys
-import urllib.request
-
-USER_AGENT = "eddimed-medals-bot/1.0 (https://github.com/Eddimed/eddimed_webpage)"
 
+from _http import conditional_get, store_cached_page
 from events import default_event_key, get_event_config
 
 
@@ -15,20 +13,6 @@ def load_meta(meta_path):
     return {}
 
 
-def fetch_headers(url):
-    req = urllib.request.Request(url, method="HEAD")
-    req.add_header("User-Agent", USER_AGENT)
-    try:
-        with urllib.request.urlopen(req, timeout=20) as resp:
-            return resp.headers
-    except Exception:
-        # Fallback to GET if HEAD is not supported
-        req = urllib.request.Request(url, method="GET")
-        req.add_header("User-Agent", USER_AGENT)
-        with urllib.request.urlopen(req, timeout=20) as resp:
-            return resp.headers
-
-
 def write_output(changed):
     output_path = os.environ.get("GITHUB_OUTPUT")
     if output_path:
@@ -60,10 +44,15 @@ def parse_args(argv):
 def main():
     event = get_event_config(parse_args(sys.argv[1:]))
     meta = load_meta(event["meta_path"])
-    headers = fetch_headers(event["medal_url"])
+    resp = conditional_get(event["medal_url"], meta, timeout=20)
+
+    if resp.status_code == 304:
+        write_output(False)
+        print("changed=false")
+        return 0
 
-    etag = headers.get("ETag")
-    last_modified = headers.get("Last-Modified")
+    etag = resp.headers.get("ETag")
+    last_modified = resp.headers.get("Last-Modified")
 
     changed = True
     if etag and meta.get("last_etag") == etag:
@@ -71,12 +60,12 @@ def main():
     elif last_modified and meta.get("last_modified") == last_modified:
         changed = False
 
-    write_output(changed)
     if changed:
-        print("changed=true")
-        return 0
+        # Leave the body on disk so fetch_medals.py does not re-download it.
+        store_cached_page(event["key"], resp)
 
-    print("changed=false")
+    write_output(changed)
+    print(f"changed={str(changed).lower()}")
     return 0
 
 
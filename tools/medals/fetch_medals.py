@@ -1,20 +1,25 @@
 #!/usr/bin/env python3
 import csv
+import functools
 import json
+import operator
 import re
+import string
 import sys
 import unicodedata
 from datetime import datetime, timezone
-from io import StringIO
 from pathlib import Path
 
-import pandas as pd
-import requests
-import pycountry
+# lxml and pycountry are imported lazily inside the functions that need
+# them, so the 304 "no change" short-circuit never pays their import cost.
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 IOC_CODES_URL = "https://en.wikipedia.org/wiki/List_of_IOC_country_codes"
-USER_AGENT = "eddimed-medals-bot/1.0 (https://github.com/Eddimed/eddimed_webpage)"
 
+from _http import conditional_get, load_cached_page
 from events import DATA_DIR, default_event_key, get_event_config
 
 IOC_CODES_CSV = DATA_DIR / "ioc_codes.csv"
@@ -75,55 +80,81 @@ ISO2_OVERRIDES = {
     "Syria": "SY",
 }
 
+CSV_FIELDNAMES = [
+    "rank",
+    "country",
+    "noc",
+    "iso2",
+    "flag_url",
+    "gold",
+    "silver",
+    "bronze",
+    "total",
+    "is_eu",
+]
+
 
 def now_utc_iso():
     return datetime.now(timezone.utc).replace(microsecond=0).isoformat()
 
 
 def load_json(path, default):
-    if path.exists():
-        return json.loads(path.read_text(encoding="utf-8"))
-    return default
+    if not path.exists():
+        return default
+    if orjson is not None:
+        return orjson.loads(path.read_bytes())
+    return json.loads(path.read_text(encoding="utf-8"))
 
 
 def save_json(path, data):
+    if orjson is not None:
+        path.write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE))
+        return
     path.write_text(json.dumps(data, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
 
 
+_RE_BRACKET = re.compile(r"\[.*?\]")
+_RE_WS = re.compile(r"\s+")
+_RE_NONALNUM = re.compile(r"[^a-zA-Z0-9 ]+")
+_RE_DIGITS = re.compile(r"\d+")
+_NORM_TABLE = str.maketrans({"\xa0": " ", "†": "", "‡": "", "*": ""})
+_KEY_STRIP = str.maketrans("", "", string.punctuation)
+_RE_EMBEDDED_NOC = re.compile(r"^(.*)\(([A-Z]{3})\)$")
+
+
 def normalize_text(value):
     if value is None:
         return ""
     text = str(value)
-    text = re.sub(r"\[.*?\]", "", text)
-    text = text.replace("\xa0", " ")
-    text = text.replace("†", "").replace("‡", "").replace("*", "")
-    text = re.sub(r"\s+", " ", text).strip()
+    text = _RE_BRACKET.sub("", text)
+    text = text.translate(_NORM_TABLE)
+    text = _RE_WS.sub(" ", text).strip()
     return text
 
 
-def split_embedded_noc(value):
-    text = normalize_text(value)
-    match = re.match(r"^(.*)\(([A-Z]{3})\)$", text)
+def split_embedded_noc(text):
+    # Callers pass text that already went through normalize_text.
+    match = _RE_EMBEDDED_NOC.match(text)
     if not match:
         return text, None
     return match.group(1).strip(), match.group(2)
 
 
+@functools.lru_cache(maxsize=4096)
 def name_key(value):
     text = normalize_text(value)
     text = NAME_OVERRIDES.get(text, text)
+    if text.isascii():
+        # Most country names are plain ASCII; skip NFKD entirely, and a
+        # translate table strips punctuation in one C-level pass.
+        return text.translate(_KEY_STRIP).lower().strip()
     text = unicodedata.normalize("NFKD", text)
-    text = "".join([c for c in text if not unicodedata.combining(c)])
-    text = re.sub(r"[^a-zA-Z0-9 ]+", "", text).lower().strip()
+    _combining = unicodedata.combining
+    text = "".join(c for c in text if not _combining(c))
+    text = _RE_NONALNUM.sub("", text).lower().strip()
     return text
 
 
-def fetch_url(url):
-    resp = requests.get(url, headers={"User-Agent": USER_AGENT}, timeout=30)
-    resp.raise_for_status()
-    return resp.text, resp.headers
-
-
 def maybe_refresh_ioc_codes():
     if IOC_CODES_CSV.exists():
         with IOC_CODES_CSV.open("r", encoding="utf-8", newline="") as fh:
@@ -131,144 +162,221 @@ def maybe_refresh_ioc_codes():
             if any(row.get("noc") for row in reader):
                 return
 
-    html, _ = fetch_url(IOC_CODES_URL)
-    tables = pd.read_html(StringIO(html))
+    import lxml.html
+
+    html = conditional_get(IOC_CODES_URL).text
+    doc = lxml.html.fromstring(html)
     target = None
-    for df in tables:
-        cols = [str(c).strip().lower() for c in df.columns]
-        if "code" in cols and any("national olympic committee" in c for c in cols):
-            target = df
+    code_idx = None
+    noc_idx = None
+    for table in doc.xpath("//table"):
+        header = [cell_text(c).lower() for c in table.xpath(".//tr[1]/th")]
+        if "code" in header and any("national olympic committee" in c for c in header):
+            target = table
+            code_idx = header.index("code")
+            noc_idx = next(i for i, c in enumerate(header) if "national olympic committee" in c)
             break
     if target is None:
         raise RuntimeError("Could not find IOC codes table on Wikipedia.")
 
-    col_map = {str(c).strip().lower(): c for c in target.columns}
-    code_col = col_map.get("code")
-    noc_col = None
-    for c in target.columns:
-        if "national olympic committee" in str(c).strip().lower():
-            noc_col = c
-            break
     rows = []
-    for _, row in target.iterrows():
-        code = normalize_text(row.get(code_col))
-        name = normalize_text(row.get(noc_col))
+    for cells in table_grid(target)[1:]:
+        code = cells[code_idx] if code_idx < len(cells) else ""
+        name = cells[noc_idx] if noc_idx < len(cells) else ""
         if not code or len(code) != 3:
             continue
         rows.append((code, name))
 
-    IOC_CODES_CSV.write_text("noc,country_name\n", encoding="utf-8")
-    with IOC_CODES_CSV.open("a", encoding="utf-8", newline="") as fh:
+    with IOC_CODES_CSV.open("w", encoding="utf-8", newline="", buffering=1 << 20) as fh:
         writer = csv.writer(fh)
-        for code, name in sorted(set(rows)):
-            writer.writerow([code, name])
+        writer.writerow(["noc", "country_name"])
+        writer.writerows(sorted(set(rows)))
 
 
 def load_ioc_codes():
     maybe_refresh_ioc_codes()
     noc_to_name = {}
     name_to_noc = {}
+    name_to_noc_lower = {}
     with IOC_CODES_CSV.open("r", encoding="utf-8", newline="") as fh:
-        reader = csv.DictReader(fh)
+        reader = csv.reader(fh)
+        header = next(reader, [])
+        noc_idx = header.index("noc")
+        name_idx = header.index("country_name")
+        last_idx = max(noc_idx, name_idx)
+        # The CSV is written by maybe_refresh_ioc_codes from already
+        # normalized text, so a plain strip is enough here.
         for row in reader:
-            noc = normalize_text(row.get("noc"))
-            name = normalize_text(row.get("country_name"))
+            if len(row) <= last_idx:
+                continue
+            noc = row[noc_idx].strip()
+            name = row[name_idx].strip()
             if not noc or not name:
                 continue
             noc_to_name[noc] = name
             name_to_noc[name_key(name)] = noc
-    return noc_to_name, name_to_noc
-
-
-def flatten_columns(df):
-    if isinstance(df.columns, pd.MultiIndex):
-        new_cols = []
-        for col in df.columns:
-            if isinstance(col, tuple):
-                parts = [normalize_text(c) for c in col if normalize_text(c)]
-                new_cols.append(parts[-1] if parts else "")
-            else:
-                new_cols.append(normalize_text(col))
-        df.columns = new_cols
-    else:
-        df.columns = [normalize_text(c) for c in df.columns]
-    return df
+            name_to_noc_lower[name.lower()] = noc
+    return noc_to_name, name_to_noc, name_to_noc_lower
 
 
+def cell_text(element):
+    return normalize_text(element.text_content())
+
+
+def cell_span(element, attr):
+    try:
+        return max(int(element.get(attr, 1)), 1)
+    except (TypeError, ValueError):
+        return 1
+
+
+def table_grid(table):
+    # Expand rowspan/colspan so every row has a value at every column index,
+    # the way pd.read_html used to present the table.
+    grid = []
+    pending = {}
+    for tr in table.xpath(".//tr"):
+        cells = []
+        col = 0
+        for element in tr.xpath("./th|./td"):
+            while col in pending:
+                text, remaining = pending.pop(col)
+                cells.append(text)
+                if remaining > 1:
+                    pending[col] = (text, remaining - 1)
+                col += 1
+            text = cell_text(element)
+            rowspan = cell_span(element, "rowspan")
+            for _ in range(cell_span(element, "colspan")):
+                cells.append(text)
+                if rowspan > 1:
+                    pending[col] = (text, rowspan - 1)
+                col += 1
+        while col in pending:
+            text, remaining = pending.pop(col)
+            cells.append(text)
+            if remaining > 1:
+                pending[col] = (text, remaining - 1)
+            col += 1
+        grid.append(cells)
+    return grid
+
+
+_MEDAL_TABLE_XPATH = "//table[contains(@class,'wikitable')][.//th[normalize-space()='Gold']]"
+
+
+def slice_medal_table_html(html):
+    # Cheap substring scan for the wikitable with Gold/Silver headers, so
+    # lxml only has to parse a few KB instead of the whole article.
+    pos = 0
+    while True:
+        start = html.find("<table", pos)
+        if start == -1:
+            return None
+        end = html.find("</table>", start)
+        if end == -1:
+            return None
+        end += len("</table>")
+        chunk = html[start:end]
+        if "wikitable" in chunk[:200] and "Gold" in chunk and "Silver" in chunk:
+            return chunk
+        pos = end
+
 
 def pick_medal_table(html):
-    tables = pd.read_html(StringIO(html))
-    for df in tables:
-        df = flatten_columns(df.copy())
-        cols = [str(c).strip().lower() for c in df.columns]
-        if {"gold", "silver", "bronze", "total"}.issubset(set(cols)):
-            if any(c in cols for c in ["nation", "noc", "team", "country", "country/region", "country or region"]):
-                return df
-            return df
-    raise RuntimeError("Could not find medal table with required columns.")
+    import lxml.html
+
+    snippet = slice_medal_table_html(html)
+    if snippet is not None:
+        tables = lxml.html.fromstring(snippet).xpath(_MEDAL_TABLE_XPATH)
+        if tables:
+            return tables[0]
 
+    # Fallback: parse the full document (e.g. nested tables broke the slice).
+    tables = lxml.html.fromstring(html).xpath(_MEDAL_TABLE_XPATH)
+    if not tables:
+        raise RuntimeError("Could not find medal table with required columns.")
+    return tables[0]
 
-def parse_medal_table(html, name_to_noc, noc_to_name):
-    df = pick_medal_table(html)
-    df = flatten_columns(df)
 
-    colnames = [str(c).strip().lower() for c in df.columns]
-    col_map = {str(c).strip().lower(): c for c in df.columns}
+def parse_medal_table(html, name_to_noc, noc_to_name, name_to_noc_lower):
+    grid = table_grid(pick_medal_table(html))
+    if not grid:
+        raise RuntimeError("Medal table is empty.")
+
+    colnames = [c.lower() for c in grid[0]]
 
     def find_col(*candidates):
         for cand in candidates:
-            for col in colnames:
+            for idx, col in enumerate(colnames):
                 if cand in col:
-                    return col_map.get(col)
+                    return idx
         return None
 
     rank_col = find_col("rank", "rk")
     nation_col = find_col("nation", "team", "country")
     noc_col = find_col("noc")
 
-    medal_cols = {find_col("gold"): "gold", find_col("silver"): "silver", find_col("bronze"): "bronze", find_col("total"): "total"}
-    medal_cols = {k: v for k, v in medal_cols.items() if k}
+    gold_col = find_col("gold")
+    silver_col = find_col("silver")
+    bronze_col = find_col("bronze")
+    total_col = find_col("total")
+
+    medal_cols = {gold_col, silver_col, bronze_col, total_col}
+    medal_cols.discard(None)
 
     if nation_col is None:
-        for col in df.columns:
-            if col in medal_cols or col == rank_col or col == noc_col:
+        for idx in range(len(colnames)):
+            if idx in medal_cols or idx == rank_col or idx == noc_col:
                 continue
-            nation_col = col
+            nation_col = idx
             break
 
+    body_cells = grid[1:]
+
     if nation_col is None and noc_col is not None:
-        sample_values = [normalize_text(v) for v in df[noc_col].head(5).tolist()]
+        sample_values = [cells[noc_col] for cells in body_cells[:5] if noc_col < len(cells)]
         if any(v and len(v) > 3 for v in sample_values):
             nation_col = noc_col
             noc_col = None
 
+    def get_cell(cells, idx):
+        if idx is None or idx >= len(cells):
+            return ""
+        return cells[idx]
+
     def to_int(value):
-        text = normalize_text(value)
-        text = re.sub(r"[^0-9]", "", text)
-        return int(text) if text else 0
+        # Cells are already normalized text; just pull the first digit run.
+        if not value:
+            return 0
+        match = _RE_DIGITS.search(value)
+        return int(match.group()) if match else 0
 
     rows = []
     unmapped = []
 
-    for _, row in df.iterrows():
-        country_raw = normalize_text(row.get(nation_col)) if nation_col else ""
-        noc_raw = normalize_text(row.get(noc_col)) if noc_col else ""
+    for cells in body_cells:
+        if not cells:
+            continue
+        country_raw = get_cell(cells, nation_col)
+        noc_raw = get_cell(cells, noc_col)
         country_raw, embedded_noc = split_embedded_noc(country_raw)
         country = NAME_OVERRIDES.get(country_raw, country_raw)
 
         if not country or country.lower().startswith("total"):
             continue
 
-        gold = to_int(row.get(find_col("gold")))
-        silver = to_int(row.get(find_col("silver")))
-        bronze = to_int(row.get(find_col("bronze")))
-        total = to_int(row.get(find_col("total")))
+        gold = to_int(get_cell(cells, gold_col))
+        silver = to_int(get_cell(cells, silver_col))
+        bronze = to_int(get_cell(cells, bronze_col))
+        total = to_int(get_cell(cells, total_col))
         if total == 0:
             total = gold + silver + bronze
 
         noc = noc_raw or embedded_noc
         if not noc or len(noc) != 3:
-            noc = name_to_noc.get(name_key(country))
+            # Exact lowercase match avoids name_key's NFKD work for most rows.
+            noc = name_to_noc_lower.get(country.lower()) or name_to_noc.get(name_key(country))
         if not noc:
             noc = NOC_OVERRIDES.get(country)
         if not noc:
@@ -284,7 +392,7 @@ def parse_medal_table(html, name_to_noc, noc_to_name):
 
         rows.append(
             {
-                "rank": to_int(row.get(rank_col)) if rank_col else None,
+                "rank": to_int(get_cell(cells, rank_col)) if rank_col is not None else None,
                 "country": country_name,
                 "noc": noc,
                 "iso2": iso2,
@@ -299,6 +407,9 @@ def parse_medal_table(html, name_to_noc, noc_to_name):
     return rows, sorted(set(unmapped))
 
 
+_rank_key = operator.itemgetter("gold", "silver", "bronze", "total")
+
+
 def compute_rank(rows):
     rows_sorted = sorted(
         rows,
@@ -307,7 +418,7 @@ def compute_rank(rows):
     rank = 0
     prev_key = None
     for idx, row in enumerate(rows_sorted, start=1):
-        key = (row["gold"], row["silver"], row["bronze"], row["total"])
+        key = _rank_key(row)
         if key != prev_key:
             rank = idx
             prev_key = key
@@ -315,12 +426,38 @@ def compute_rank(rows):
     return rows_sorted
 
 
+def _build_name_to_iso2():
+    import pycountry
+
+    index = {}
+    for country in pycountry.countries:
+        index[country.name.lower()] = country.alpha_2
+        for attr in ("official_name", "common_name"):
+            alias = getattr(country, attr, None)
+            if alias:
+                index[alias.lower()] = country.alpha_2
+    return index
+
+
+_NAME_TO_ISO2 = None
+
+
+@functools.lru_cache(maxsize=4096)
 def iso2_from_country(country_name):
+    global _NAME_TO_ISO2
+
     if not country_name:
         return None
     if country_name in ISO2_OVERRIDES:
         return ISO2_OVERRIDES[country_name]
+    if _NAME_TO_ISO2 is None:
+        _NAME_TO_ISO2 = _build_name_to_iso2()
+    iso2 = _NAME_TO_ISO2.get(country_name.lower())
+    if iso2:
+        return iso2
     try:
+        import pycountry
+
         match = pycountry.countries.search_fuzzy(country_name)[0]
         return match.alpha_2
     except Exception:
@@ -333,14 +470,16 @@ def load_eu_members():
 
 
 def add_eu_row(rows, eu_members):
-    eu_nocs = {m["noc"] for m in eu_members if m.get("noc")}
-    gold = sum(r["gold"] for r in rows if r["noc"] in eu_nocs)
-    silver = sum(r["silver"] for r in rows if r["noc"] in eu_nocs)
-    bronze = sum(r["bronze"] for r in rows if r["noc"] in eu_nocs)
-    total = gold + silver + bronze
-
+    eu_nocs = frozenset(m["noc"] for m in eu_members if m.get("noc"))
+    gold = silver = bronze = 0
     for r in rows:
-        r["is_eu"] = r["noc"] in eu_nocs
+        is_eu = r["noc"] in eu_nocs
+        r["is_eu"] = is_eu
+        if is_eu:
+            gold += r["gold"]
+            silver += r["silver"]
+            bronze += r["bronze"]
+    total = gold + silver + bronze
 
     rows.append(
         {
@@ -358,28 +497,13 @@ def add_eu_row(rows, eu_members):
     )
 
 
-def write_outputs(rows, meta, unmapped, event):
+def write_outputs(rows, meta, unmapped, event, meta_loaded=None):
     rows = compute_rank(rows)
 
-    with event["csv_path"].open("w", encoding="utf-8", newline="") as fh:
-        writer = csv.DictWriter(
-            fh,
-            fieldnames=[
-                "rank",
-                "country",
-                "noc",
-                "iso2",
-                "flag_url",
-                "gold",
-                "silver",
-                "bronze",
-                "total",
-                "is_eu",
-            ],
-        )
-        writer.writeheader()
-        for row in rows:
-            writer.writerow(row)
+    with event["csv_path"].open("w", encoding="utf-8", newline="", buffering=1 << 20) as fh:
+        writer = csv.writer(fh)
+        writer.writerow(CSV_FIELDNAMES)
+        writer.writerows([row.get(name) for name in CSV_FIELDNAMES] for row in rows)
 
     medals_payload = {
         "event_key": event["key"],
@@ -397,7 +521,8 @@ def write_outputs(rows, meta, unmapped, event):
     save_json(event["json_path"], medals_payload)
 
     meta["unmapped_countries"] = unmapped
-    save_json(event["meta_path"], meta)
+    if meta != meta_loaded:
+        save_json(event["meta_path"], meta)
 
 
 def parse_args(argv):
@@ -442,10 +567,22 @@ def main():
             "unmapped_countries": [],
         },
     )
-
-    html, headers = fetch_url(event["medal_url"])
-    etag = headers.get("ETag")
-    last_modified = headers.get("Last-Modified")
+    meta_loaded = dict(meta)
+
+    cached = load_cached_page(event["key"])
+    if cached is not None:
+        # etag_check.py already downloaded the page this run.
+        html, cached_meta = cached
+        etag = cached_meta.get("etag")
+        last_modified = cached_meta.get("last_modified")
+    else:
+        resp = conditional_get(event["medal_url"], meta=None if force else meta)
+        if resp.status_code == 304:
+            print("No changes detected (HTTP 304).")
+            return 0
+        html = resp.text
+        etag = resp.headers.get("ETag")
+        last_modified = resp.headers.get("Last-Modified")
 
     if not force:
         if etag and meta.get("last_etag") == etag:
@@ -462,17 +599,19 @@ def main():
     meta["event_key"] = event["key"]
     meta["source_url"] = event["medal_url"]
 
-    noc_to_name, name_to_noc = load_ioc_codes()
-    rows, unmapped = parse_medal_table(html, name_to_noc, noc_to_name)
+    noc_to_name, name_to_noc, name_to_noc_lower = load_ioc_codes()
+    rows, unmapped = parse_medal_table(html, name_to_noc, noc_to_name, name_to_noc_lower)
 
     if unmapped:
+        # Only the plain meta dict is written here, never the rows payload.
         meta["unmapped_countries"] = unmapped
-        save_json(event["meta_path"], meta)
+        if meta != meta_loaded:
+            save_json(event["meta_path"], meta)
         raise RuntimeError(f"Unmapped countries: {', '.join(unmapped)}")
 
     eu_members = load_eu_members()
     add_eu_row(rows, eu_members)
-    write_outputs(rows, meta, unmapped, event)
+    write_outputs(rows, meta, unmapped, event, meta_loaded=meta_loaded)
 
     print(f"{event['event_label']} medal table updated.")
     return 0